@@ -5,8 +5,14 @@ AI Auto Developer - OpenRouter + GitHub Integration (Free Models)
 import os
 import sys
 import re
+import time
+import tempfile
+import asyncio
 import traceback
 
+from model_health import ModelHealth, classify_error
+from context_packer import ContextPacker
+
 print("🔍 Starting AI Coder...", flush=True)
 print(f"Python version: {sys.version}", flush=True)
 
@@ -24,14 +30,14 @@ except ImportError as e:
 
 try:
     print("📦 Importing openai module...", flush=True)
-    from openai import OpenAI
+    from openai import AsyncOpenAI
     print("✅ openai module imported", flush=True)
 except ImportError as e:
     print(f"❌ Failed to import openai: {e}", flush=True)
     print("Installing openai...", flush=True)
     import subprocess
     subprocess.run([sys.executable, "-m", "pip", "install", "openai", "-q"])
-    from openai import OpenAI
+    from openai import AsyncOpenAI
 
 # --- 設定: 無料モデル定義 ---
 # OpenRouterの無料モデル（2025年3月時点で利用可能）
@@ -49,34 +55,212 @@ FREE_MODELS = [
 # デフォルトモデル
 DEFAULT_MODEL = FREE_MODELS[0]
 
+# AIレスポンス中のファイル書き込みブロック
+FILE_BLOCK_RE = re.compile(r"FILENAME:\s*([^\n]+)\n```[a-zA-Z0-9]*\n(.*?)```", re.DOTALL)
+
+# レース設定: 同時に走らせるモデル数 (1 で従来の順番試行)
+RACE_WIDTH = int(os.getenv("AI_RACE_WIDTH", "3"))
+# 先行リクエストが返らない場合、次のモデルを追加で投げるまでの秒数
+HEDGE_DELAY = float(os.getenv("AI_HEDGE_DELAY", "20"))
+
 
-def try_create_completion(client, models, messages, timeout=180):
+def log_model_error(model, e, health=None):
+    """モデル呼び出しの失敗理由をログに出し、ヘルス記録に残す"""
+    kind = classify_error(e)
+    if kind == "not_found":
+        print(f"   ⚠️ Model not available: {model}", flush=True)
+    elif kind == "no_credits":
+        print(f"   ⚠️ Insufficient credits for: {model}", flush=True)
+    elif kind == "timeout":
+        print(f"   ⚠️ Timed out: {model}", flush=True)
+    else:
+        print(f"   ⚠️ Error with {model}: {str(e)[:100]}", flush=True)
+    if health:
+        health.record_failure(model, kind)
+
+
+class FileBlockParser:
     """
-    モデルリストを順番に試して、利用可能なモデルでAPIコールを実行
+    ストリーミング中のレスポンスから FILENAME: ブロックを逐次取り出すパーサー
+    閉じフェンスが届いた時点でブロックを返す
     """
-    for model in models:
-        try:
-            print(f"   Trying model: {model}", flush=True)
-            completion = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                timeout=timeout
-            )
-            print(f"   ✅ Success with: {model}", flush=True)
-            return completion, model
-        except Exception as e:
-            error_msg = str(e)
-            if "404" in error_msg or "not found" in error_msg.lower():
-                print(f"   ⚠️ Model not available: {model}", flush=True)
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+
+    def feed(self, text):
+        """テキストを追加し、新たに閉じたブロックを (path, content) のリストで返す"""
+        scan_from = max(self.pos, len(self.buffer) - 2)
+        self.buffer += text
+        # 新しいフェンスが届いていなければ再検索しない
+        if "```" not in self.buffer[scan_from:]:
+            return []
+
+        blocks = []
+        while True:
+            match = FILE_BLOCK_RE.search(self.buffer, self.pos)
+            if not match:
+                break
+            blocks.append((match.group(1).strip(), match.group(2)))
+            self.pos = match.end()
+        return blocks
+
+
+class StreamState:
+    """1モデル分のストリーミング結果"""
+
+    def __init__(self, model):
+        self.model = model
+        self.started = time.monotonic()
+        # 最初の FILENAME: ブロックが閉じた時刻 (ヘルス記録のレイテンシに使う)
+        self.first_block_at = None
+        self.chunks = []
+        self.parser = FileBlockParser()
+        self.modified_files = []
+
+    @property
+    def text(self):
+        return "".join(self.chunks)
+
+
+async def stream_completion(client, state, messages, claim):
+    """
+    レスポンスをストリーミングで受け取り、閉じたブロックをその場で書き込む
+    最初のブロックが閉じた時点で claim() で勝者を名乗り、負けたら打ち切る
+    """
+    stream = await client.chat.completions.create(
+        model=state.model,
+        messages=messages,
+        stream=True
+    )
+    try:
+        async for chunk in stream:
+            if not chunk.choices:
                 continue
-            elif "402" in error_msg or "credits" in error_msg.lower():
-                print(f"   ⚠️ Insufficient credits for: {model}", flush=True)
+            delta = chunk.choices[0].delta.content
+            if not delta:
                 continue
-            else:
-                print(f"   ⚠️ Error with {model}: {error_msg[:100]}", flush=True)
+
+            state.chunks.append(delta)
+            blocks = state.parser.feed(delta)
+            if not blocks:
+                continue
+            if not claim(state):
+                return
+            if state.first_block_at is None:
+                state.first_block_at = time.monotonic()
+            for file_path, content in blocks:
+                if apply_file_block(file_path, content):
+                    state.modified_files.append(file_path)
+    finally:
+        await stream.close()
+
+
+async def race_create_completion(client, models, messages, timeout=180,
+                                 width=RACE_WIDTH, hedge_delay=HEDGE_DELAY, health=None):
+    """
+    複数モデルを並列にストリーミングし、最初に FILENAME: ブロックを閉じたモデルを採用する
+
+    - 最初は1モデルだけ投げ、hedge_delay 秒ごとに次のモデルを追加する (最大 width 本)
+      width=1 なら従来通りモデルを順番に試す
+    - 失敗したモデルの枠はすぐに次のモデルで埋める
+    - 勝者が決まったら残りのリクエストはキャンセルし、勝者のブロックは届いた順に書き込む
+    - 勝者が途中でタイムアウトしても、それまでに書き込んだファイルは残す
+    - FILENAME: を含まない応答は控えとして持ち、他がすべて終わったら返す
+
+    Returns:
+        (response_text, model, modified_files, truncated)。全滅なら (None, None, [], False)
+        truncated は勝者のストリームが途中で切れた場合 True
+    """
+    pending = list(models)
+    running = {}
+    winner = []
+    fallback = None
+
+    def claim(state):
+        if not winner:
+            winner.append(state)
+            print(f"   🏆 {state.model} produced the first file block", flush=True)
+            for task, other in running.items():
+                if other is not state:
+                    task.cancel()
+        return winner[0] is state
+
+    def launch():
+        state = StreamState(pending.pop(0))
+        print(f"   Racing model: {state.model}", flush=True)
+        task = asyncio.create_task(asyncio.wait_for(
+            stream_completion(client, state, messages, claim),
+            timeout
+        ))
+        running[task] = state
+
+    launch()
+    try:
+        while running:
+            can_hedge = not winner and fallback is None and pending and len(running) < width
+            done, _ = await asyncio.wait(
+                running,
+                timeout=hedge_delay if can_hedge else None,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+
+            if not done:
+                # 待っている間に勝者や控えが決まっていたらヘッジしない
+                if winner or fallback is not None or not pending or len(running) >= width:
+                    continue
+                print(f"   ⏱️ No file block after {hedge_delay:.0f}s, hedging...", flush=True)
+                launch()
                 continue
-    
-    return None, None
+
+            failed = 0
+            for task in done:
+                state = running.pop(task)
+                if task.cancelled():
+                    continue
+                error = task.exception()
+
+                if winner and winner[0] is state:
+                    if error:
+                        log_model_error(state.model, error, health)
+                        print(f"   ⚠️ Stream ended early; keeping {len(state.modified_files)} completed files", flush=True)
+                    else:
+                        print(f"   ✅ Success with: {state.model}", flush=True)
+                        if health:
+                            health.record_success(state.model, state.first_block_at - state.started)
+                    return state.text, state.model, state.modified_files, error is not None
+
+                if error:
+                    log_model_error(state.model, error, health)
+                    failed += 1
+                    continue
+
+                if winner:
+                    continue
+                # ファイルを書かない応答は成功扱いにしない (短い応答ほど速く見えてしまうため)
+                if health:
+                    health.record_no_files(state.model)
+
+                print(f"   ℹ️ {state.model} answered without FILENAME blocks", flush=True)
+                if fallback is None:
+                    fallback = state
+
+            # 失敗した枠を埋める (勝者か控えの応答がある場合は新しいモデルは投げない)
+            for _ in range(failed):
+                if not winner and fallback is None and pending and len(running) < width:
+                    launch()
+    finally:
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+
+    if fallback:
+        print(f"   ✅ Using response from: {fallback.model}", flush=True)
+        return fallback.text, fallback.model, [], False
+
+    return None, None, [], False
 
 
 def decide_model_category(title, body):
@@ -92,40 +276,42 @@ def decide_model_category(title, body):
     return "standard"
 
 
-def apply_file_changes(response_text):
-    """
-    AIのレスポンスからファイル書き込みブロックを抽出して適用する
-    """
-    pattern = r"FILENAME:\s*([^\n]+)\n```[a-zA-Z0-9]*\n(.*?)```"
-    matches = re.findall(pattern, response_text, re.DOTALL)
-
-    modified_files = []
-
-    if not matches:
-        print("ℹ️ No file changes detected in AI response.", flush=True)
-        return []
-
-    print(f"⚡ Applying {len(matches)} file changes...", flush=True)
+def is_safe_path(file_path):
+    """リポジトリ外や .git への書き込みを防ぐ"""
+    if not file_path or '..' in file_path or file_path.startswith('/'):
+        return False
+    parts = os.path.normpath(file_path).split(os.sep)
+    return parts[0] != '.git'
 
-    for file_path, content in matches:
-        file_path = file_path.strip()
 
-        # セキュリティ対策
-        if '..' in file_path or file_path.startswith('/'):
-            print(f"  ⚠️ Skipped (security): {file_path}", flush=True)
-            continue
+def apply_file_block(file_path, content):
+    """
+    1つのファイルブロックを一時ファイル + rename でアトミックに書き込む
+    途中で中断しても中途半端な内容のファイルは残らない
+    """
+    # セキュリティ対策
+    if not is_safe_path(file_path):
+        print(f"  ⚠️ Skipped (security): {file_path}", flush=True)
+        return False
 
-        dir_path = os.path.dirname(file_path)
-        if dir_path:
-            os.makedirs(dir_path, exist_ok=True)
+    dir_path = os.path.dirname(file_path)
+    if dir_path:
+        os.makedirs(dir_path, exist_ok=True)
 
-        with open(file_path, "w", encoding="utf-8") as f:
+    mode = os.stat(file_path).st_mode & 0o777 if os.path.exists(file_path) else 0o644
+    fd, tmp_path = tempfile.mkstemp(dir=dir_path or ".", prefix=".ai-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
             f.write(content)
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
 
-        print(f"  📝 Wrote to: {file_path}", flush=True)
-        modified_files.append(file_path)
-
-    return modified_files
+    print(f"  📝 Wrote to: {file_path}", flush=True)
+    return True
 
 
 def main():
@@ -212,41 +398,63 @@ Details: "{issue_body}"
 
 Please implement the solution. If this is a bug fix, explain what was wrong and how you fixed it.
 If this is a feature, implement it with clean, maintainable code.
+"""
+
+        # 関連するリポジトリのファイルをトークン予算内で添付する
+        try:
+            repo_context = ContextPacker().pack(f"{issue_title}\n{issue_body}")
+        except Exception as e:
+            print(f"⚠️ Warning: Could not build repository context: {e}", flush=True)
+            repo_context = ""
+
+        if repo_context:
+            user_prompt += f"""
+Relevant files from the repository (current content; SUMMARY blocks are outlines only):
+
+{repo_context}
 """
 
         # --- 6. AI実行（複数モデルを試行）---
         print(f"🧠 Trying free models...", flush=True)
         
-        client = OpenAI(
+        client = AsyncOpenAI(
             base_url="https://openrouter.ai/api/v1",
             api_key=router_key,
         )
         
-        completion, selected_model = try_create_completion(
-            client, 
-            FREE_MODELS, 
-            [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ]
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ]
+
+        health = ModelHealth()
+        models = health.order_models(FREE_MODELS)
+
+        if RACE_WIDTH > 1:
+            print(f"   🏁 Racing up to {RACE_WIDTH} models (hedge delay {HEDGE_DELAY:.0f}s)", flush=True)
+
+        # --- 7. コードの適用 (ストリーミング中にブロックごとに書き込む) ---
+        response_text, selected_model, modified_files, truncated = asyncio.run(
+            race_create_completion(client, models, messages, health=health)
         )
+
+        health.save()
+        health.write_summary(FREE_MODELS)
         
-        if not completion:
+        if response_text is None:
             error_msg = "All free models failed. Please check your OpenRouter account or try again later."
             print(f"❌ {error_msg}", flush=True)
             if issue:
                 try:
-                    issue.create_comment(f"❌ **AI Error**: {error_msg}\n\nTried models: {', '.join(FREE_MODELS)}")
+                    issue.create_comment(f"❌ **AI Error**: {error_msg}\n\nTried models: {', '.join(models)}")
                 except:
                     pass
             sys.exit(1)
         
-        response_text = completion.choices[0].message.content
         print(f"✅ AI response received from: {selected_model}", flush=True)
         print(f"   Response length: {len(response_text)} chars", flush=True)
-
-        # --- 7. コードの適用 ---
-        modified_files = apply_file_changes(response_text)
+        if not modified_files:
+            print("ℹ️ No file changes detected in AI response.", flush=True)
 
         # --- 8. 結果報告 ---
         if issue:
@@ -254,7 +462,12 @@ If this is a feature, implement it with clean, maintainable code.
             comment = f"🤖 **AI Auto-Dev Report**\n\n"
             comment += f"**Model Used:** `{selected_model}`\n\n"
 
-            if modified_files:
+            if modified_files and truncated:
+                comment += f"### ⚠️ Partially Applied Changes to:\n{files_log}\n\n"
+                comment += ("The model's response was cut off before it finished. "
+                            "Only the files above were completed; other files it intended to change may be missing. "
+                            "Please review the Pull Request carefully.")
+            elif modified_files:
                 comment += f"### ✅ Applied Changes to:\n{files_log}\n\n"
                 comment += "Changes have been committed and a Pull Request will be created."
             else:
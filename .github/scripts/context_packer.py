@@ -0,0 +1,273 @@
+"""
+Repository context packer for AI Auto Developer
+
+Issue のタイトル・本文に関係しそうなファイルをリポジトリから選び、
+トークン予算内に収まるようにプロンプト用のコンテキストへまとめる。
+
+- ファイル一覧と blob SHA は `git ls-files -s` から取得する
+- ファイルごとの識別子・要約・トークン数は blob SHA をキーにキャッシュする
+  (内容が変わっていないファイルは run をまたいで再処理しない)
+- 日本語は分かち書きされないので、かな・漢字の連続は文字bigramに分けて検索語にする
+"""
+import json
+import math
+import os
+import re
+import subprocess
+
+DEFAULT_CACHE_PATH = os.path.expanduser("~/.cache/lore-anchor/context_cache.json")
+DEFAULT_TOKEN_BUDGET = int(os.getenv("AI_CONTEXT_TOKENS", "12000"))
+# これより大きいファイルは要約のみ送る
+MAX_FILE_BYTES = 60_000
+# 要約に含める宣言行の最大数
+MAX_SUMMARY_LINES = 25
+# 検索語の作り方を変えたら上げる (古いキャッシュは捨てて作り直す)
+CACHE_VERSION = 2
+
+SOURCE_EXTENSIONS = {
+    ".py", ".ts", ".tsx", ".js", ".jsx", ".css", ".html",
+    ".md", ".yml", ".yaml", ".json", ".toml", ".txt", ".sh",
+}
+SKIP_PATHS = ("web/dist/", "node_modules/")
+SKIP_FILES = {"package-lock.json", "requests.jsonl"}
+
+_IDENT_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]{2,}")
+_CJK_RE = re.compile(r"[぀-ヿ㐀-鿿]{2,}")
+_HIRAGANA_RE = re.compile(r"^[぀-ゟ]+$")
+_BACKTICKS_RE = re.compile(r"`+")
+_CAMEL_RE = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+")
+_DECL_RE = re.compile(
+    r"^\s*(?:export\s+)?(?:default\s+)?(?:async\s+)?"
+    r"(?:def|class|function|interface|type|const|let)\s+[A-Za-z_]\w*"
+)
+STOPWORDS = {
+    "the", "and", "for", "with", "this", "that", "from", "into", "are", "was",
+    "not", "but", "should", "would", "want", "when", "then", "than", "have",
+    "has", "can", "use", "using", "only", "each", "all", "any", "one", "more",
+    "self", "none", "true", "false", "return", "import", "print", "def", "class",
+    "const", "let", "export", "function", "async", "await", "str", "int",
+}
+
+
+def estimate_tokens(text):
+    """おおよそのトークン数 (ASCII は4文字で1トークン、それ以外は1文字1トークン)"""
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return (len(text) - non_ascii) // 4 + non_ascii + 1
+
+
+def fence_for(text):
+    """中身のどのバッククォート列よりも長いコードフェンスを返す"""
+    longest = max((len(run) for run in _BACKTICKS_RE.findall(text)), default=0)
+    return "`" * max(3, longest + 1)
+
+
+def terms(text):
+    """
+    識別子を snake_case / camelCase で分割し、小文字の検索語にする
+    かな・漢字の連続は文字bigramにする (ひらがなだけのbigramは助詞・語尾なので除く)
+    """
+    result = []
+    for ident in _IDENT_RE.findall(text):
+        lowered = ident.lower()
+        if lowered not in STOPWORDS:
+            result.append(lowered)
+        for part in _CAMEL_RE.findall(ident.replace("_", " ")):
+            part = part.lower()
+            if len(part) > 2 and part != lowered and part not in STOPWORDS:
+                result.append(part)
+    for run in _CJK_RE.findall(text):
+        result.extend(
+            gram for gram in (run[i:i + 2] for i in range(len(run) - 1))
+            if not _HIRAGANA_RE.match(gram)
+        )
+    return result
+
+
+def summarize(path, text):
+    """先頭のコメント/docstringと宣言行からなる短い要約"""
+    lines = text.splitlines()
+    head = []
+    for line in lines[:8]:
+        stripped = line.strip()
+        if stripped.startswith(("#!", "import ", "from ")):
+            continue
+        if stripped:
+            head.append(stripped)
+        if len(head) >= 3:
+            break
+
+    decls = [line.rstrip() for line in lines if _DECL_RE.match(line)][:MAX_SUMMARY_LINES]
+    return "\n".join(head + decls)
+
+
+def list_files(repo_root="."):
+    """
+    追跡中のファイルを (path, blob SHA) で返す
+    作業ツリーで変更されたファイルは中身から SHA を計算し直す
+    """
+    output = subprocess.run(
+        ["git", "ls-files", "-s"], cwd=repo_root, capture_output=True, text=True, check=True
+    ).stdout
+    modified = set(subprocess.run(
+        ["git", "ls-files", "-m"], cwd=repo_root, capture_output=True, text=True, check=True
+    ).stdout.splitlines())
+
+    files = []
+    for line in output.splitlines():
+        meta, path = line.split("\t", 1)
+        mode, sha, _ = meta.split()
+        if mode == "160000" or path.startswith(SKIP_PATHS):
+            continue
+        if os.path.basename(path) in SKIP_FILES or os.path.splitext(path)[1] not in SOURCE_EXTENSIONS:
+            continue
+        if path in modified:
+            sha = subprocess.run(
+                ["git", "hash-object", path], cwd=repo_root, capture_output=True, text=True
+            ).stdout.strip() or sha
+        files.append((path, sha))
+    return files
+
+
+class ContextPacker:
+    def __init__(self, repo_root=".", cache_path=None):
+        self.repo_root = repo_root
+        self.cache_path = cache_path or os.getenv("AI_CONTEXT_CACHE_PATH", DEFAULT_CACHE_PATH)
+        self.cache = {}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.cache_path, encoding="utf-8") as f:
+                data = json.load(f)
+            self.cache = data.get("files", {}) if data.get("version") == CACHE_VERSION else {}
+        except FileNotFoundError:
+            self.cache = {}
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Could not read context cache: {e}", flush=True)
+            self.cache = {}
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+            tmp_path = self.cache_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": CACHE_VERSION, "files": self.cache}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            print(f"⚠️ Could not save context cache: {e}", flush=True)
+
+    def _read(self, path):
+        full_path = os.path.join(self.repo_root, path)
+        if os.path.getsize(full_path) > MAX_FILE_BYTES * 4:
+            return None
+        try:
+            with open(full_path, encoding="utf-8") as f:
+                return f.read()
+        except (OSError, UnicodeDecodeError):
+            return None
+
+    def _analyze(self, path, sha):
+        """blob SHA に対応するキャッシュエントリを返す (無ければ作る)"""
+        entry = self.cache.get(sha)
+        if entry is not None:
+            return entry, False
+
+        text = self._read(path)
+        if text is None:
+            entry = {"skip": True}
+        else:
+            counts = {}
+            for term in terms(text):
+                counts[term] = counts.get(term, 0) + 1
+            entry = {
+                "terms": counts,
+                "tokens": estimate_tokens(text),
+                "bytes": len(text.encode("utf-8")),
+                "summary": summarize(path, text),
+            }
+        self.cache[sha] = entry
+        return entry, True
+
+    def index(self):
+        """全ファイルを解析する。変更のないファイルはキャッシュから読む"""
+        files = list_files(self.repo_root)
+        entries = []
+        fresh = 0
+        for path, sha in files:
+            entry, created = self._analyze(path, sha)
+            fresh += created
+            if not entry.get("skip"):
+                entries.append((path, entry))
+
+        # もう存在しない blob のエントリを捨てる
+        live = {sha for _, sha in files}
+        for sha in [s for s in self.cache if s not in live]:
+            del self.cache[sha]
+
+        print(f"📚 Indexed {len(entries)} files ({fresh} reprocessed, {len(files) - fresh} cached)", flush=True)
+        return entries
+
+    def rank(self, entries, query):
+        """BM25 風のスコアでファイルを並べる。パスに検索語が含まれる場合は加点する"""
+        query_terms = set(terms(query))
+        if not query_terms:
+            return []
+
+        n = len(entries)
+        avg_len = sum(sum(e["terms"].values()) for _, e in entries) / max(n, 1) or 1
+        df = {t: sum(1 for _, e in entries if t in e["terms"]) for t in query_terms}
+
+        scored = []
+        for path, entry in entries:
+            doc_len = sum(entry["terms"].values()) or 1
+            lowered_path = path.lower()
+            score = 0.0
+            for term in query_terms:
+                tf = entry["terms"].get(term, 0)
+                idf = math.log(1 + (n - df[term] + 0.5) / (df[term] + 0.5))
+                if tf:
+                    score += idf * tf * 2.2 / (tf + 1.2 * (0.25 + 0.75 * doc_len / avg_len))
+                if term in lowered_path:
+                    score += 2 * idf
+            if score > 0:
+                scored.append((score, path, entry))
+
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return scored
+
+    def pack(self, query, token_budget=DEFAULT_TOKEN_BUDGET):
+        """
+        関連度の高いファイルをトークン予算内でまとめる
+        入りきらないファイルや大きいファイルは要約だけを入れる
+
+        Returns:
+            プロンプトに埋め込むコンテキスト文字列 (該当なしなら空文字)
+        """
+        ranked = self.rank(self.index(), query)
+        self.save()
+
+        sections = []
+        used = 0
+        for _, path, entry in ranked:
+            if used >= token_budget:
+                break
+
+            if entry["tokens"] <= token_budget - used and entry["bytes"] <= MAX_FILE_BYTES:
+                text = self._read(path)
+                if text is not None:
+                    fence = fence_for(text)
+                    sections.append(f"FILE: {path}\n{fence}\n{text}\n{fence}")
+                    used += entry["tokens"]
+                    continue
+
+            summary_tokens = estimate_tokens(entry["summary"])
+            if entry["summary"] and summary_tokens <= token_budget - used:
+                fence = fence_for(entry["summary"])
+                sections.append(f"SUMMARY: {path}\n{fence}\n{entry['summary']}\n{fence}")
+                used += summary_tokens
+
+        if not sections:
+            return ""
+
+        print(f"📦 Packed {len(sections)} files into ~{used} tokens", flush=True)
+        return "\n\n".join(sections)
@@ -1,18 +1,32 @@
 import os
 import sys
-import requests
+import re
 import json
+import time
+import hashlib
+import argparse
+import subprocess
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # 環境変数からキーを取得
 ANTHROPIC_API_KEY = os.environ.get("ANTHROPIC_API_KEY")
 DISCORD_WEBHOOK_URL = os.environ.get("DISCORD_WEBHOOK_URL")
-COMMIT_MESSAGE = sys.argv[1]
+
+# 生成済みの下書きをコミットSHAごとに保存する (再実行時はAPIを呼ばない)
+CACHE_PATH = os.environ.get(
+    "DEVLOG_CACHE_PATH", os.path.expanduser("~/.cache/lore-anchor/devlog_cache.json")
+)
+# (接続, 読み込み) タイムアウト秒
+TIMEOUT = (10, 120)
+# Discordのメッセージ上限は2000文字
+DISCORD_LIMIT = 2000
+# バッチ出力の見出しからコミットIDを拾う (「### abc1234:」「### <abc1234>」「### ID abc1234」など)
+SHA_RE = re.compile(r"\b[0-9a-f]{7,40}\b")
 
 # --- 1. ノイズ除去 ---
 IGNORE_KEYWORDS = ["merge", "fix typo", "readme", "docs", "lint", "wip"]
-if any(keyword in COMMIT_MESSAGE.lower() for keyword in IGNORE_KEYWORDS) or len(COMMIT_MESSAGE) < 5:
-    print("Skipping: Commit message is trivial.")
-    sys.exit(0)
 
 # --- 2. AIペルソナ定義 ---
 SYSTEM_PROMPT = """
@@ -32,37 +46,228 @@ SYSTEM_PROMPT = """
 案3: [内容]
 """
 
+# 複数コミットをまとめて渡すときの追加指示
+BATCH_INSTRUCTIONS = """
+複数のコミットが渡される。コミットごとに、見出し行「### <ID>」(IDは渡されたものをそのまま)を書き、
+その下に上記の出力形式で投稿案を3つ書け。
+"""
+
+
+def is_trivial(message):
+    return any(keyword in message.lower() for keyword in IGNORE_KEYWORDS) or len(message) < 5
+
+
+def make_session():
+    """
+    API呼び出し用の共有セッション (接続を使い回す)
+    自動再試行はClaude APIの429/529 (リクエストが処理されていない応答) だけに限る。
+    5xxは処理済みの可能性があり、再試行すると二重生成・二重投稿になるため再試行しない。
+    Discordの429は post_to_discord で扱う
+    """
+    session = requests.Session()
+    retry = Retry(
+        total=3,
+        backoff_factor=2,
+        status_forcelist=[429, 529],
+        allowed_methods=["POST"],
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    session.mount("https://api.anthropic.com/", HTTPAdapter(max_retries=retry))
+    return session
+
+
+def get_commits(rev_range):
+    """コミット範囲から (sha, 件名) のリストを古い順で返す"""
+    output = subprocess.run(
+        ["git", "log", "--no-merges", "--reverse", "--format=%H%x1f%s", rev_range],
+        capture_output=True, text=True, check=True
+    ).stdout
+    return [tuple(line.split("\x1f", 1)) for line in output.splitlines() if "\x1f" in line]
+
+
+def load_cache():
+    try:
+        with open(CACHE_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(cache):
+    os.makedirs(os.path.dirname(CACHE_PATH) or ".", exist_ok=True)
+    with open(CACHE_PATH, "w", encoding="utf-8") as f:
+        json.dump(cache, f, ensure_ascii=False, indent=2)
+
+
 # --- 3. Claude API コール ---
-try:
+def generate_drafts(session, commits):
+    """
+    未キャッシュのコミットをまとめて1回のプロンプトで処理する
+
+    Returns:
+        {sha: 投稿案テキスト}
+    """
     headers = {
         "x-api-key": ANTHROPIC_API_KEY,
         "anthropic-version": "2023-06-01",
         "content-type": "application/json"
     }
+
+    if len(commits) == 1:
+        system = SYSTEM_PROMPT
+        user_content = f"作業内容（コミットログ）: {commits[0][1]}"
+    else:
+        system = SYSTEM_PROMPT + BATCH_INSTRUCTIONS
+        user_content = "作業内容（コミットログ）:\n" + "\n".join(
+            f"- ID {sha[:7]}: {message}" for sha, message in commits
+        )
+
     data = {
         "model": "claude-3-5-sonnet-20240620",
-        "max_tokens": 500,
-        "system": SYSTEM_PROMPT,
-        "messages": [{"role": "user", "content": f"作業内容（コミットログ）: {COMMIT_MESSAGE}"}]
+        "max_tokens": min(500 * len(commits), 8000),
+        "system": system,
+        "messages": [{"role": "user", "content": user_content}]
     }
 
-    response = requests.post("https://api.anthropic.com/v1/messages", headers=headers, json=data)
+    response = session.post("https://api.anthropic.com/v1/messages", headers=headers, json=data, timeout=TIMEOUT)
     result = response.json()
-    
+
     if "content" not in result:
-        print("Error from Claude:", result)
+        raise RuntimeError(f"Error from Claude: {result}")
+
+    text = result['content'][0]['text']
+    if len(commits) == 1:
+        return {commits[0][0]: text.strip()} if text.strip() else {}
+
+    # 既知のコミットIDを含む見出し行ごとに分割する (見出しの書式の揺れは許容する)
+    by_short = {sha[:7]: sha for sha, _ in commits}
+    sections = {}
+    current = None
+    for line in text.splitlines():
+        if line.lstrip().startswith("#"):
+            ids = [m[:7] for m in SHA_RE.findall(line.lower()) if m[:7] in by_short]
+            if ids:
+                current = by_short[ids[0]]
+                sections[current] = []
+                continue
+        if current is not None:
+            sections[current].append(line)
+
+    drafts = {}
+    for sha, lines in sections.items():
+        body = "\n".join(lines).strip()
+        if body:
+            drafts[sha] = body
+    return drafts
+
+
+# --- 4. Discord通知 ---
+def split_message(text, limit=DISCORD_LIMIT):
+    """Discordの文字数上限に収まるよう、行単位でメッセージを分割する"""
+    chunks, current = [], ""
+    for line in text.split("\n"):
+        while len(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:limit])
+            line = line[limit:]
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) > limit:
+            chunks.append(current)
+            current = line
+        else:
+            current = candidate
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def post_to_discord(session, content):
+    """Webhookのレート制限 (429 / X-RateLimit-*) を守って投稿する"""
+    for chunk in split_message(content):
+        for _ in range(5):
+            response = session.post(
+                DISCORD_WEBHOOK_URL,
+                json={"username": "Ghostwriter (DevLog)", "content": chunk},
+                timeout=TIMEOUT
+            )
+            if response.status_code == 429:
+                retry_after = response.json().get("retry_after", 1)
+                print(f"Discord rate limited, retrying in {retry_after}s")
+                time.sleep(float(retry_after))
+                continue
+            response.raise_for_status()
+            break
+        else:
+            raise RuntimeError("Discord webhook kept returning 429")
+
+        # 残り回数が0なら、リセットまで待ってから次を送る
+        if response.headers.get("X-RateLimit-Remaining") == "0":
+            time.sleep(float(response.headers.get("X-RateLimit-Reset-After", 1)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="コミットからDevLog投稿案を生成してDiscordに送る")
+    parser.add_argument("message", nargs="?", help="単一のコミットメッセージ")
+    parser.add_argument("--range", dest="rev_range", help="まとめて処理するコミット範囲 (例: BEFORE..AFTER)")
+    args = parser.parse_args()
+
+    if args.rev_range:
+        commits = get_commits(args.rev_range)
+    elif args.message:
+        # SHAが無いのでメッセージのハッシュをキャッシュキーにする
+        commits = [("msg-" + hashlib.sha1(args.message.encode("utf-8")).hexdigest(), args.message)]
+    else:
+        parser.error("message または --range を指定してください")
+
+    commits = [(sha, message) for sha, message in commits if not is_trivial(message)]
+    if not commits:
+        print("Skipping: Commit message is trivial.")
+        sys.exit(0)
+
+    try:
+        session = make_session()
+        cache = load_cache()
+
+        missing = [(sha, message) for sha, message in commits if sha not in cache]
+        generated = {}
+        if missing:
+            generated = generate_drafts(session, missing)
+            # 出力から拾えなかったコミットは1回だけまとめて再生成する
+            retry = [(sha, message) for sha, message in missing if sha not in generated]
+            if retry:
+                print(f"Warning: No draft found for {len(retry)} commits, retrying once.")
+                generated.update(generate_drafts(session, retry))
+            cache.update(generated)
+            save_cache(cache)
+
+        for sha, message in missing:
+            if sha not in generated:
+                print(f"Warning: No draft generated for {sha[:7]} ({message})")
+        print(
+            f"Drafts: {len(commits) - len(missing)} cached, {len(generated)} generated, "
+            f"{len(missing) - len(generated)} missing."
+        )
+
+        sections = []
+        for sha, message in commits:
+            drafts = cache.get(sha)
+            if drafts:
+                sections.append(f"`{message}`\n{drafts}")
+        if not sections:
+            print("Error: No drafts were generated.")
+            sys.exit(1)
+
+        title = "🛠 **New Commit Detected!**" if len(sections) == 1 else f"🛠 **{len(sections)} New Commits Detected!**"
+        post_to_discord(session, title + "\n\n" + "\n\n".join(sections))
+        print("Successfully sent to Discord.")
+
+    except Exception as e:
+        print(f"Error: {e}")
         sys.exit(1)
-        
-    tweet_drafts = result['content'][0]['text']
 
-    # --- 4. Discord通知 ---
-    discord_data = {
-        "username": "Ghostwriter (DevLog)",
-        "content": f"🛠 **New Commit Detected!**\n`{COMMIT_MESSAGE}`\n\n{tweet_drafts}"
-    }
-    requests.post(DISCORD_WEBHOOK_URL, json=discord_data)
-    print("Successfully sent to Discord.")
 
-except Exception as e:
-    print(f"Error: {e}")
-    sys.exit(1)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Model health cache / circuit breaker for AI Auto Developer
+
+Workflow run をまたいでモデルごとの成功率・レイテンシ・直近の失敗を保存し、
+最近失敗したモデルをスキップ、残りを観測レイテンシ順に並べる。
+ファイルは actions/cache で run 間に引き継ぐ (.github/workflows/ai-manager.yml)。
+"""
+import json
+import os
+import time
+
+DEFAULT_PATH = os.path.expanduser("~/.cache/lore-anchor/model_health.json")
+
+# 失敗の種類ごとのクールダウン(秒)。連続失敗のたびに倍になる (上限 MAX_COOLDOWN)
+COOLDOWNS = {
+    "not_found": 24 * 3600,    # 404: モデルが消えた / 名前が変わった
+    "no_credits": 6 * 3600,    # 402: 無料枠切れ
+    "timeout": 30 * 60,
+    "error": 15 * 60,
+}
+MAX_COOLDOWN = 7 * 24 * 3600
+# レイテンシの指数移動平均の重み
+EWMA_ALPHA = 0.3
+
+
+def classify_error(e):
+    """例外を失敗の種類に分類する"""
+    error_msg = str(e).lower()
+    if "404" in error_msg or "not found" in error_msg:
+        return "not_found"
+    if "402" in error_msg or "credits" in error_msg:
+        return "no_credits"
+    if "timeout" in error_msg or "timed out" in error_msg or type(e).__name__.endswith("TimeoutError"):
+        return "timeout"
+    return "error"
+
+
+class ModelHealth:
+    def __init__(self, path=None):
+        self.path = path or os.getenv("AI_MODEL_HEALTH_PATH", DEFAULT_PATH)
+        self.models = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self.models = json.load(f).get("models", {})
+            print(f"📈 Loaded model health for {len(self.models)} models", flush=True)
+        except FileNotFoundError:
+            self.models = {}
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Could not read model health cache: {e}", flush=True)
+            self.models = {}
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"models": self.models}, f, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"⚠️ Could not save model health cache: {e}", flush=True)
+
+    def _entry(self, model):
+        return self.models.setdefault(model, {
+            "successes": 0,
+            "failures": 0,
+            "consecutive_failures": 0,
+            "no_files": 0,
+            "latency": None,
+            "last_failure": None,
+            "last_error": None,
+        })
+
+    def record_success(self, model, latency):
+        entry = self._entry(model)
+        entry["successes"] += 1
+        entry["consecutive_failures"] = 0
+        if entry["latency"] is None:
+            entry["latency"] = latency
+        else:
+            entry["latency"] = EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * entry["latency"]
+
+    def record_no_files(self, model):
+        """
+        FILENAME: ブロックなしで答えたモデルを記録する
+        成功率・レイテンシ・サーキットには影響させない
+        """
+        entry = self._entry(model)
+        entry["no_files"] = entry.get("no_files", 0) + 1
+
+    def record_failure(self, model, kind):
+        entry = self._entry(model)
+        entry["failures"] += 1
+        entry["consecutive_failures"] += 1
+        entry["last_failure"] = time.time()
+        entry["last_error"] = kind
+
+    def cooldown_remaining(self, model, now=None):
+        """サーキットが開いている(スキップ中の)残り秒数。閉じていれば 0"""
+        entry = self.models.get(model)
+        if not entry or not entry["consecutive_failures"] or not entry["last_failure"]:
+            return 0
+        base = COOLDOWNS.get(entry["last_error"], COOLDOWNS["error"])
+        cooldown = min(base * 2 ** (entry["consecutive_failures"] - 1), MAX_COOLDOWN)
+        return max(0, entry["last_failure"] + cooldown - (now or time.time()))
+
+    def order_models(self, models):
+        """
+        サーキットが開いているモデルを除き、観測レイテンシの速い順に並べる
+        未計測のモデルは元の順番のまま計測済みモデルの後ろに置く。
+        全モデルがスキップ対象になった場合は、元のリストをそのまま返す
+        """
+        now = time.time()
+        available = []
+        for index, model in enumerate(models):
+            remaining = self.cooldown_remaining(model, now)
+            if remaining:
+                entry = self.models[model]
+                print(f"   ⏭️ Skipping {model} ({entry['last_error']}, retry in {remaining / 60:.0f} min)", flush=True)
+                continue
+            latency = (self.models.get(model) or {}).get("latency")
+            available.append((latency is None, latency or 0, index, model))
+
+        if not available:
+            print("   ⚠️ All models are cooling down; trying them all anyway", flush=True)
+            return list(models)
+
+        return [model for *_, model in sorted(available)]
+
+    def report(self, models=None):
+        """モデルごとの統計を Markdown の表にまとめる"""
+        names = list(models) if models else []
+        names += [m for m in sorted(self.models) if m not in names]
+
+        lines = [
+            "| Model | Success rate | Runs | No files | Latency to first file (EWMA) | Last error | Status |",
+            "|---|---|---|---|---|---|---|",
+        ]
+        now = time.time()
+        for model in names:
+            entry = self.models.get(model)
+            if not entry:
+                lines.append(f"| `{model}` | - | 0 | - | - | - | untested |")
+                continue
+            runs = entry["successes"] + entry["failures"]
+            rate = f"{entry['successes'] / runs:.0%}" if runs else "-"
+            latency = f"{entry['latency']:.1f}s" if entry["latency"] is not None else "-"
+            remaining = self.cooldown_remaining(model, now)
+            status = f"skipped ({remaining / 60:.0f} min)" if remaining else "ok"
+            lines.append(
+                f"| `{model}` | {rate} | {runs} | {entry.get('no_files', 0)} | {latency} | "
+                f"{entry['last_error'] or '-'} | {status} |"
+            )
+        return "\n".join(lines)
+
+    def write_summary(self, models=None):
+        """ログと GitHub Actions のジョブサマリーにレポートを出力する"""
+        report = "### 🩺 Model Health\n\n" + self.report(models) + "\n"
+        print(report, flush=True)
+        summary_path = os.getenv("GITHUB_STEP_SUMMARY")
+        if summary_path:
+            try:
+                with open(summary_path, "a", encoding="utf-8") as f:
+                    f.write(report)
+            except OSError as e:
+                print(f"⚠️ Could not write step summary: {e}", flush=True)
+
+
+if __name__ == "__main__":
+    ModelHealth().write_summary()
@@ -4,10 +4,14 @@ from pydantic import BaseModel
 from typing import List, Optional
 import os
 import shutil
+import tempfile
+import asyncio
 from dotenv import load_dotenv
 
 # Import custom modules (ensure modules/ is in path or package structure)
 from modules.search_engine import reverse_image_search
+from modules.canonicalizer import canonicalize_results
+from modules.preprocessor import preprocess_image, get_process_pool, shutdown_process_pool
 from modules.detector import classify_results, get_suspicious_urls
 from modules.generator import generate_takedown_request, get_summary_statistics
 
@@ -36,6 +40,10 @@ class TakedownRequest(BaseModel):
 class ScanRequest(BaseModel):
     whitelist: str
 
+@app.on_event("shutdown")
+def shutdown():
+    shutdown_process_pool()
+
 @app.get("/")
 def read_root():
     return {"message": "Lore-Anchor Patrol API is running"}
@@ -47,28 +55,43 @@ async def scan_image(
     api_key: Optional[str] = Form(None)
 ):
     try:
-        # Create temp file
-        temp_filename = f"temp_{file.filename}"
-        with open(temp_filename, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
         # Determine API Key
         env_api_key = os.getenv("SERPAPI_KEY", "")
         key_to_use = api_key if api_key else env_api_key
         
-        # Search
-        search_results = reverse_image_search(temp_filename, key_to_use) 
-        # Checking app.py: search_by_image(uploaded_file, api_key) where uploaded_file is Streamlit's UploadedFile. 
-        # We might need to adjust search_by_image if it expects a specific object, but passing path is safer if modified.
-        # However, modules/search_engine.py is likely designed for Streamlit. Let's assume for now it handles what we give or we might need to fix it.
-        # Actually, let's look at search_by_image in a moment if it fails. For now, passing the file logic.
-        
-        # Clean up temp file
-        os.remove(temp_filename)
+        loop = asyncio.get_running_loop()
+
+        # Each request gets its own temp directory, so concurrent scans of
+        # files with the same name never touch each other's variants
+        temp_dir = tempfile.mkdtemp(prefix="lore-anchor-")
+        try:
+            # Create temp file
+            temp_filename = os.path.join(temp_dir, os.path.basename(file.filename or "") or "upload")
+            with open(temp_filename, "wb") as buffer:
+                shutil.copyfileobj(file.file, buffer)
+
+            # Preprocess (strip metadata, downscale, crop variants) in the process pool
+            variant_paths = await loop.run_in_executor(get_process_pool(), preprocess_image, temp_filename)
+
+            # Search every variant concurrently; duplicates are merged by canonicalize_results.
+            # Only the full image may fall back to mock results, so an empty crop
+            # search does not mix fake URLs into real ones.
+            variant_results = await asyncio.gather(*[
+                loop.run_in_executor(None, reverse_image_search, path, key_to_use, index == 0)
+                for index, path in enumerate(variant_paths)
+            ])
+        finally:
+            # Clean up the upload and every variant, even after a preprocess failure
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+        search_results = [result for results in variant_results for result in results]
 
         if not search_results:
             return {"status": "no_results", "data": []}
 
+        # Canonicalize & dedupe (http/https, mobile hosts, tracking params...)
+        search_results = canonicalize_results(search_results)
+
         # Parse whitelist
         whitelist_domains = [domain.strip() for domain in whitelist.split(",") if domain.strip()]
         
@@ -0,0 +1,236 @@
+"""
+Canonicalizer Module for Lore-Anchor Patrol
+Normalizes search result URLs and removes duplicate pages before classification
+"""
+
+import hashlib
+import re
+from functools import lru_cache
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from typing import List, Dict, Optional
+
+
+# Rules applied to every host. Per-domain entries in DOMAIN_RULES are merged on top.
+#   strip_subdomains: leading labels removed from the host (mobile / www mirrors)
+#   drop_params: query keys removed (trailing '*' matches a prefix)
+#   keep_params: if set, only these query keys are kept
+#   alias: canonical host that this domain is rewritten to
+DEFAULT_RULES = {
+    "strip_subdomains": ["www", "m", "sp", "mobile"],
+    "drop_params": ["utm_*", "ref", "ref_src", "ref_url", "fbclid", "gclid", "igshid"],
+    "keep_params": None,
+    "alias": None,
+}
+
+DOMAIN_RULES = {
+    "x.com": {"alias": "twitter.com", "keep_params": []},
+    "twitter.com": {"keep_params": []},
+    "pixiv.net": {"keep_params": ["illust_id", "id"]},
+    "youtube.com": {"keep_params": ["v", "list"]},
+}
+
+_DEFAULT_PORTS = {"http": "80", "https": "443"}
+
+
+def _compile_rule(rule: Dict) -> Dict:
+    """
+    Precompiles a merged rule so it can be applied to many URLs cheaply
+    """
+    drop = rule.get("drop_params") or []
+    exact = {p.lower() for p in drop if not p.endswith("*")}
+    prefixes = tuple(p[:-1].lower() for p in drop if p.endswith("*"))
+    keep = rule.get("keep_params")
+
+    return {
+        "strip_subdomains": tuple(rule.get("strip_subdomains") or []),
+        "drop_exact": exact,
+        "drop_prefixes": prefixes,
+        "keep_params": None if keep is None else {p.lower() for p in keep},
+        "alias": rule.get("alias"),
+    }
+
+
+@lru_cache(maxsize=1)
+def _default_compiled_rules() -> Dict[str, Dict]:
+    return _build_rule_table(None)
+
+
+def _build_rule_table(domain_rules: Optional[Dict[str, Dict]]) -> Dict[str, Dict]:
+    """
+    Merges per-domain overrides with the default rule and compiles them
+
+    Args:
+        domain_rules: Per-domain overrides (None uses DOMAIN_RULES)
+
+    Returns:
+        Mapping of domain -> compiled rule, with '*' as the fallback entry
+    """
+    rules = DOMAIN_RULES if domain_rules is None else domain_rules
+    table = {"*": _compile_rule(DEFAULT_RULES)}
+    for domain, override in rules.items():
+        merged = dict(DEFAULT_RULES)
+        merged.update(override)
+        table[domain.lower()] = _compile_rule(merged)
+    return table
+
+
+def _strip_host(host: str, strip_subdomains: tuple) -> str:
+    labels = host.split(".")
+    while len(labels) > 2 and labels[0] in strip_subdomains:
+        labels = labels[1:]
+    return ".".join(labels)
+
+
+def _resolve_host(host: str, table: Dict[str, Dict], cache: Dict[str, tuple]) -> tuple:
+    """
+    Returns (canonical_host, rule) for a raw host, memoized per batch
+    """
+    if host in cache:
+        return cache[host]
+
+    default = table["*"]
+    stripped = _strip_host(host, default["strip_subdomains"])
+
+    # Longest matching suffix wins (e.g. 'sub.pixiv.net' -> 'pixiv.net')
+    rule = default
+    labels = stripped.split(".")
+    for i in range(len(labels) - 1):
+        candidate = ".".join(labels[i:])
+        if candidate in table:
+            rule = table[candidate]
+            break
+
+    canonical = _strip_host(stripped, rule["strip_subdomains"])
+    if rule["alias"]:
+        canonical = rule["alias"]
+        rule = table.get(canonical, rule)
+
+    cache[host] = (canonical, rule)
+    return cache[host]
+
+
+def _filter_query(query: str, rule: Dict) -> str:
+    if not query:
+        return ""
+
+    keep = rule["keep_params"]
+    kept = []
+    for key, value in parse_qsl(query, keep_blank_values=True):
+        lowered = key.lower()
+        if keep is not None:
+            if lowered in keep:
+                kept.append((key, value))
+            continue
+        if lowered in rule["drop_exact"] or lowered.startswith(rule["drop_prefixes"]):
+            continue
+        kept.append((key, value))
+
+    kept.sort()
+    return urlencode(kept)
+
+
+def _canonicalize(url: str, table: Dict[str, Dict], host_cache: Dict[str, tuple]) -> str:
+    url = url.strip()
+    try:
+        parts = urlsplit(url if "://" in url else "https://" + url)
+    except ValueError:
+        return url
+
+    scheme = parts.scheme.lower()
+    if scheme not in _DEFAULT_PORTS:
+        return url
+
+    host = (parts.hostname or "").rstrip(".")
+    if not host:
+        return url
+
+    try:
+        port = parts.port
+    except ValueError:
+        return url
+
+    canonical_host, rule = _resolve_host(host, table, host_cache)
+    if port is not None and str(port) not in _DEFAULT_PORTS.values():
+        canonical_host = f"{canonical_host}:{port}"
+
+    path = re.sub(r"/{2,}", "/", parts.path or "/")
+    if len(path) > 1:
+        path = path.rstrip("/")
+    if path == "/":
+        path = ""
+
+    query = _filter_query(parts.query, rule)
+
+    # http and https copies of the same page are collapsed to https
+    return urlunsplit(("https", canonical_host, path, query, ""))
+
+
+def url_hash(canonical_url: str) -> str:
+    """
+    Returns a compact 64-bit hash used as the dedupe key for a canonical URL
+    """
+    return hashlib.blake2b(canonical_url.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def canonicalize_url(url: str, domain_rules: Optional[Dict[str, Dict]] = None) -> str:
+    """
+    Normalizes a single URL
+
+    Args:
+        url: Raw URL returned by the search engine
+        domain_rules: Per-domain overrides (None uses DOMAIN_RULES)
+
+    Returns:
+        Canonical form of the URL
+    """
+    table = _default_compiled_rules() if domain_rules is None else _build_rule_table(domain_rules)
+    return _canonicalize(url, table, {})
+
+
+def canonicalize_results(search_results: List[Dict[str, str]],
+                         domain_rules: Optional[Dict[str, Dict]] = None) -> List[Dict]:
+    """
+    Canonicalizes and deduplicates a batch of search results
+
+    The whole batch shares one compiled rule table and one host cache, and
+    identical raw URLs are only parsed once, so this stays far cheaper than the
+    per-URL classification and takedown work it removes.
+
+    Args:
+        search_results: List of search result dictionaries with 'url' and 'title'
+        domain_rules: Per-domain overrides (None uses DOMAIN_RULES)
+
+    Returns:
+        List of unique results in first-seen order. 'url' keeps the first raw
+        URL returned by the search engine (shown to the user and used in
+        takedown letters), 'canonical_url' the normalized form used for
+        deduping, 'url_hash' the dedupe key and 'alternates' the other raw forms.
+    """
+    table = _default_compiled_rules() if domain_rules is None else _build_rule_table(domain_rules)
+    host_cache: Dict[str, tuple] = {}
+    raw_cache: Dict[str, str] = {}
+    unique: Dict[str, Dict] = {}
+
+    for result in search_results:
+        raw_url = result.get('url', '')
+        if not raw_url:
+            continue
+
+        canonical = raw_cache.get(raw_url)
+        if canonical is None:
+            canonical = _canonicalize(raw_url, table, host_cache)
+            raw_cache[raw_url] = canonical
+
+        key = url_hash(canonical)
+        entry = unique.get(key)
+        if entry is None:
+            entry = dict(result)
+            entry['url'] = raw_url
+            entry['canonical_url'] = canonical
+            entry['url_hash'] = key
+            entry['alternates'] = []
+            unique[key] = entry
+        elif raw_url != entry['url'] and raw_url not in entry['alternates']:
+            entry['alternates'].append(raw_url)
+
+    return list(unique.values())
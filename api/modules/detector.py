@@ -76,7 +76,10 @@ def classify_results(search_results: List[Dict[str, str]],
         except:
             domain = url
 
-        if is_whitelisted(url, whitelist_domains):
+        # Canonicalized results carry the raw forms they were merged from
+        alternates = result.get('alternates', [])
+
+        if any(is_whitelisted(u, whitelist_domains) for u in [url] + alternates):
             status = "safe"
         else:
             status = "suspicious"
@@ -87,7 +90,9 @@ def classify_results(search_results: List[Dict[str, str]],
             'url': url,
             'domain': domain,
             'status': status,
-            'similarity': 90 # Default high confidence for found results as placeholder
+            'similarity': 90, # Default high confidence for found results as placeholder
+            'canonical_url': result.get('canonical_url', url),
+            'alternates': alternates
         })
 
     return classified_results
@@ -0,0 +1,131 @@
+"""
+Preprocessor Module for Lore-Anchor Patrol
+Shrinks uploaded images before reverse image search
+Decoding runs in a process pool so large uploads don't block the API workers
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Sequence
+
+from PIL import Image, ImageOps
+
+# Longest edge after downscaling. Google Lens does not need more to find matches.
+DEFAULT_MAX_EDGE = 1600
+DEFAULT_FORMAT = "JPEG"
+DEFAULT_QUALITY = 85
+
+_EXTENSIONS = {"JPEG": ".jpg", "WEBP": ".webp", "PNG": ".png"}
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    Returns the shared process pool used for decoding (created on first use)
+    """
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=int(os.getenv("IMAGE_WORKERS", "2")))
+    return _pool
+
+
+def shutdown_process_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _to_rgb(image: Image.Image) -> Image.Image:
+    """
+    Flattens transparency onto white so the image can be saved as JPEG
+    """
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+
+def _center_crop(image: Image.Image, ratio: float) -> Image.Image:
+    width, height = image.size
+    crop_w, crop_h = int(width * ratio), int(height * ratio)
+    left, top = (width - crop_w) // 2, (height - crop_h) // 2
+    return image.crop((left, top, left + crop_w, top + crop_h))
+
+
+def _save(image: Image.Image, path: str, image_format: str, quality: int) -> None:
+    # Saving a fresh image without exif/info drops all metadata from the upload
+    options = {"optimize": True}
+    if image_format in ("JPEG", "WEBP"):
+        options["quality"] = quality
+    image.save(path, format=image_format, **options)
+
+
+def _crop_ratios_from_env() -> List[float]:
+    # Comma separated center-crop ratios, e.g. "0.6" adds a 60% center crop variant
+    return [float(r) for r in os.getenv("IMAGE_CROP_VARIANTS", "").split(",") if r.strip()]
+
+
+def preprocess_image(image_path: str,
+                     max_edge: Optional[int] = None,
+                     image_format: Optional[str] = None,
+                     quality: Optional[int] = None,
+                     crop_ratios: Optional[Sequence[float]] = None) -> List[str]:
+    """
+    Decodes an image once and writes compact variants for reverse image search
+
+    Settings that are not passed are read from the IMAGE_* environment
+    variables on each call, so values loaded from .env after import apply.
+
+    Args:
+        image_path: Path to the uploaded image file
+        max_edge: Longest edge in pixels after downscaling (IMAGE_MAX_EDGE)
+        image_format: Output format, JPEG, WEBP or PNG (IMAGE_FORMAT)
+        quality: Encoder quality for lossy formats (IMAGE_QUALITY)
+        crop_ratios: Center-crop ratios for extra variants, catches cropped reposts (IMAGE_CROP_VARIANTS)
+
+    Returns:
+        List of variant file paths, the full image first.
+        Falls back to [image_path] if the image cannot be decoded.
+    """
+    if max_edge is None:
+        max_edge = int(os.getenv("IMAGE_MAX_EDGE", str(DEFAULT_MAX_EDGE)))
+    if image_format is None:
+        image_format = os.getenv("IMAGE_FORMAT", DEFAULT_FORMAT)
+    if quality is None:
+        quality = int(os.getenv("IMAGE_QUALITY", str(DEFAULT_QUALITY)))
+    if crop_ratios is None:
+        crop_ratios = _crop_ratios_from_env()
+
+    image_format = image_format.upper()
+    extension = _EXTENSIONS.get(image_format)
+    if extension is None:
+        raise ValueError(f"Unsupported image format: {image_format}")
+
+    try:
+        with Image.open(image_path) as source:
+            # Let the JPEG decoder skip detail we would throw away anyway
+            source.draft("RGB", (max_edge, max_edge))
+            image = ImageOps.exif_transpose(source)
+            image = _to_rgb(image) if image_format == "JPEG" else image.convert(
+                "RGBA" if "A" in image.getbands() else "RGB")
+    except Exception as e:
+        print(f"Preprocess Error: {e}. Using original upload.")
+        return [image_path]
+
+    image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    base, _ = os.path.splitext(image_path)
+    variants = [(f"{base}_full{extension}", image)]
+    for ratio in crop_ratios:
+        if 0 < ratio < 1:
+            variants.append((f"{base}_crop{int(ratio * 100)}{extension}", _center_crop(image, ratio)))
+
+    paths = []
+    for path, variant in variants:
+        _save(variant, path, image_format, quality)
+        paths.append(path)
+    return paths
@@ -33,13 +33,16 @@ def get_mock_results() -> List[Dict[str, str]]:
     ]
 
 
-def reverse_image_search(image_path: str, api_key: str = None) -> List[Dict[str, str]]:
+def reverse_image_search(image_path: str, api_key: str = None,
+                         fallback_to_mock: bool = True) -> List[Dict[str, str]]:
     """
     Performs reverse image search using SerpApi Google Lens
 
     Args:
         image_path: Path to the uploaded image file
         api_key: SerpApi API key (optional, uses Mock mode if not provided)
+        fallback_to_mock: Return mock results when the search finds nothing or
+            fails. Set to False for extra searches merged into real results.
 
     Returns:
         List of dictionaries containing 'url' and 'title' of found images
@@ -74,9 +77,14 @@ def reverse_image_search(image_path: str, api_key: str = None) -> List[Dict[str,
                 "title": match.get("title", "No Title")
             })
 
-        return parsed_results if parsed_results else get_mock_results()
+        if parsed_results or not fallback_to_mock:
+            return parsed_results
+        return get_mock_results()
 
     except Exception as e:
+        if not fallback_to_mock:
+            print(f"API Error: {e}.")
+            return []
         # Fallback to Mock mode on error
         print(f"API Error: {e}. Falling back to Mock mode.")
         return get_mock_results()
@@ -1,7 +1,12 @@
 import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import discord
 from dotenv import load_dotenv
-from github import Github
+from github import Github, GithubException, RateLimitExceededException
+from duplicate_index import DuplicateIndex
 
 # 1. 環境変数の読み込み
 load_dotenv()
@@ -25,7 +30,8 @@ client = discord.Client(intents=intents)
 
 # GitHub Clientの設定
 try:
-    g = Github(GITHUB_TOKEN)
+    # レート制限の再試行は call_with_backoff で行うので、PyGithub側の再試行は無効にする
+    g = Github(GITHUB_TOKEN, retry=None)
     repo = g.get_repo(REPO_NAME)
 except Exception as e:
     print(f"❌ エラー: GitHubリポジトリ '{REPO_NAME}' にアクセスできませんでした。")
@@ -44,6 +50,267 @@ CHANNEL_CONFIG = {
     }
 }
 
+# Issue作成キューの設定
+# GitHub APIは同期呼び出し(PyGithub)なので、イベントループを止めないよう
+# スレッドプール上のワーカーで処理する
+ISSUE_WORKERS = int(os.getenv('ISSUE_WORKERS', '2'))
+ISSUE_QUEUE_SIZE = int(os.getenv('ISSUE_QUEUE_SIZE', '100'))
+# 同じ人・同じチャンネルの連投はこの秒数まで待って1つのIssueにまとめる
+COALESCE_SECONDS = float(os.getenv('COALESCE_SECONDS', '5'))
+MAX_RETRIES = 5
+MAX_BACKOFF_SECONDS = 300
+
+# 重複検出の設定（DUPLICATE_THRESHOLD=0 で無効）
+DUPLICATE_THRESHOLD = float(os.getenv('DUPLICATE_THRESHOLD', '0.5'))
+INDEX_PATH = os.getenv('INDEX_PATH', 'issue_index.json')
+INDEX_SYNC_SECONDS = int(os.getenv('INDEX_SYNC_SECONDS', '300'))
+
+github_executor = ThreadPoolExecutor(max_workers=ISSUE_WORKERS + 1, thread_name_prefix="github")
+issue_queue = asyncio.Queue(maxsize=ISSUE_QUEUE_SIZE)
+# (channel_id, author_id) -> まだワーカーが取り出していないジョブ
+pending_jobs = {}
+duplicate_index = (
+    DuplicateIndex(REPO_NAME, GITHUB_TOKEN, path=INDEX_PATH, threshold=DUPLICATE_THRESHOLD)
+    if DUPLICATE_THRESHOLD > 0 else None
+)
+
+
+class IssueJob:
+    """1つのIssueにまとめられるDiscordメッセージの集まり"""
+
+    def __init__(self, key, config):
+        self.key = key
+        self.config = config
+        self.created_at = time.monotonic()
+        self.messages = []
+        # 受付メッセージ。返信の送信中にジョブが進むことがあるので、messages とは別に持つ
+        self.acks = []
+        self.started = False
+        # ワーカーの処理結果（受付メッセージに表示する内容と、スレッドを作るIssue番号）
+        self.result_content = None
+        self.thread_issue = None
+        self.thread_created = False
+
+
+def is_rate_limited(error):
+    """
+    レート制限によるエラーか判定する
+    権限不足などの403は再試行しても直らないので対象外
+    """
+    if isinstance(error, RateLimitExceededException):
+        return True
+    return getattr(error, "status", None) == 429 or "secondary rate limit" in str(error).lower()
+
+
+def retry_delay(error, attempt):
+    """
+    GitHubのレート制限ヘッダー(Retry-After / X-RateLimit-*)から待機秒数を決める
+    レート制限以外のエラーならNoneを返す
+    """
+    if not is_rate_limited(error):
+        return None
+
+    headers = {k.lower(): v for k, v in (getattr(error, "headers", None) or {}).items()}
+
+    if "retry-after" in headers:
+        try:
+            return min(float(headers["retry-after"]), MAX_BACKOFF_SECONDS)
+        except ValueError:
+            pass
+
+    if headers.get("x-ratelimit-remaining") == "0" and "x-ratelimit-reset" in headers:
+        try:
+            reset = float(headers["x-ratelimit-reset"]) - time.time()
+            return min(max(reset, 1), MAX_BACKOFF_SECONDS)
+        except ValueError:
+            pass
+
+    # セカンダリレート制限でヘッダーが無い場合は指数バックオフ（最低60秒）
+    return min(60 * (2 ** attempt), MAX_BACKOFF_SECONDS)
+
+
+def call_with_backoff(func, *args, **kwargs):
+    """ワーカースレッド上で実行される。レート制限時はバックオフして再試行する"""
+    for attempt in range(MAX_RETRIES):
+        try:
+            return func(*args, **kwargs)
+        except GithubException as e:
+            delay = retry_delay(e, attempt)
+            if delay is None or attempt == MAX_RETRIES - 1:
+                raise
+            print(f"   ⏳ GitHubレート制限: {delay:.0f}秒後に再試行 ({attempt + 1}/{MAX_RETRIES})")
+            time.sleep(delay)
+
+
+def build_issue(job):
+    """ジョブ内のメッセージからIssueのタイトルと本文を作る"""
+    config = job.config
+    first = job.messages[0]
+
+    # タイトル: 接頭辞 + 最初のメッセージの冒頭30文字
+    safe_content = first.content.replace("\n", " ")
+    title_suffix = safe_content[:30] + "..." if len(safe_content) > 30 else safe_content
+    issue_title = f"{config['prefix']}{title_suffix}"
+
+    # 本文: 投稿者名、元メッセージのURL、メッセージ全文
+    issue_body = (
+        f"**Reporter:** {first.author.display_name} ({first.author})\n"
+        f"**Source:** {first.jump_url}\n\n"
+        f"**Content:**\n{first.content}"
+    )
+    for message in job.messages[1:]:
+        issue_body += (
+            f"\n\n---\n"
+            f"**Source:** {message.jump_url}\n\n"
+            f"{message.content}"
+        )
+
+    return issue_title, issue_body
+
+
+def comment_on_duplicate(number, job):
+    """既存Issueに重複報告としてコメントする"""
+    issue = repo.get_issue(number=number)
+    body = "**Duplicate report from Discord**\n"
+    for message in job.messages:
+        body += (
+            f"\n**Reporter:** {message.author.display_name} ({message.author})\n"
+            f"**Source:** {message.jump_url}\n\n"
+            f"{message.content}\n"
+        )
+    issue.create_comment(body)
+
+
+async def handle_duplicate(job, loop):
+    """
+    同じラベルのopen Issueから重複を探す
+    確実な重複なら既存Issueにコメントして (True, None) を返す。
+    似ているだけなら (False, (issue番号, issue情報)) を返し、新しいIssueは通常どおり作る
+    """
+    if duplicate_index is None:
+        return False, None
+
+    text = "\n".join(message.content for message in job.messages)
+    found = duplicate_index.find_duplicate(text, label=job.config['labels'][0])
+    if found is None:
+        return False, None
+
+    number, issue, score, confident = found
+    if not confident:
+        print(f"   🔍 Possible duplicate of #{number} (similarity {score:.2f})")
+        return False, (number, issue)
+
+    await loop.run_in_executor(github_executor, call_with_backoff, comment_on_duplicate, number, job)
+    print(f"   🔁 Duplicate of #{number} (similarity {score:.2f})")
+
+    await finish_job(job, (
+        f"似た報告が既にあったため、こちらにコメントしました: {issue['url']}\n"
+        f"開発用コマンド: `claude issue {number}`"
+    ))
+    return True, None
+
+
+async def sync_index_loop():
+    """open Issueのインデックスを定期的に同期する（変化のないページはETagで304になる）"""
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            changed = await loop.run_in_executor(github_executor, duplicate_index.sync)
+            if changed:
+                print(f"🔄 Issueインデックスを更新しました ({len(duplicate_index.issues)}件)")
+        except Exception as e:
+            print(f"⚠️ Issueインデックスの同期に失敗しました: {e}")
+        await asyncio.sleep(INDEX_SYNC_SECONDS)
+
+
+async def deliver_ack(job, ack):
+    """受付メッセージを処理結果に書き換える。最初の1件にだけ議論用スレッドを作る"""
+    await ack.edit(content=job.result_content)
+    if job.thread_issue is not None and not job.thread_created:
+        job.thread_created = True
+        await ack.create_thread(name=f"Discussion: Issue #{job.thread_issue}")
+
+
+async def finish_job(job, content, thread_issue=None):
+    """
+    処理結果を記録し、送信済みの受付メッセージに反映する
+    まだ送信中の受付メッセージは、on_message 側で送信後に反映される
+    """
+    job.result_content = content
+    job.thread_issue = thread_issue
+    for ack in list(job.acks):
+        await deliver_ack(job, ack)
+
+
+async def process_job(job):
+    # 連投をまとめるため、最初のメッセージから一定時間待つ
+    wait = COALESCE_SECONDS - (time.monotonic() - job.created_at)
+    if wait > 0:
+        await asyncio.sleep(wait)
+
+    job.started = True
+    pending_jobs.pop(job.key, None)
+
+    issue_title, issue_body = build_issue(job)
+    loop = asyncio.get_running_loop()
+
+    try:
+        handled, possible = await handle_duplicate(job, loop)
+        if handled:
+            return
+        if possible is not None:
+            issue_body += f"\n\n---\nPossible duplicate of #{possible[0]}"
+
+        issue = await loop.run_in_executor(
+            github_executor,
+            partial(
+                call_with_backoff,
+                repo.create_issue,
+                title=issue_title,
+                body=issue_body,
+                labels=job.config['labels']
+            )
+        )
+        if duplicate_index is not None:
+            duplicate_index.add_issue(
+                issue.number, issue_title, issue_body, issue.html_url, job.config['labels']
+            )
+    except Exception as e:
+        error_msg = f"❌ エラーが発生しました: {e}"
+        print(error_msg)
+        await finish_job(job, error_msg)
+        return
+
+    print(f"   ✅ Issue Created: #{issue.number} {issue.html_url} ({len(job.messages)}件)")
+
+    # 受付メッセージをIssueのリンクに差し替え、スレッドを作成（議論用）
+    content = (
+        f"{issue.html_url}\n"
+        f"開発用コマンド: `claude issue {issue.number}`"
+    )
+    if possible is not None:
+        content += f"\n似た報告があります (重複の可能性): {possible[1]['url']}"
+    await finish_job(job, content, thread_issue=issue.number)
+
+
+async def issue_worker():
+    while True:
+        job = await issue_queue.get()
+        try:
+            await process_job(job)
+        except Exception as e:
+            print(f"❌ ワーカーでエラーが発生しました: {e}")
+        finally:
+            issue_queue.task_done()
+
+
+@client.event
+async def setup_hook():
+    for _ in range(ISSUE_WORKERS):
+        client.loop.create_task(issue_worker())
+    if duplicate_index is not None:
+        client.loop.create_task(sync_index_loop())
+
 @client.event
 async def on_ready():
     print(f"Botが起動しました（リポジトリ名: {REPO_NAME}）")
@@ -66,44 +333,33 @@ async def on_message(message):
     if not content.strip():
         return
 
-    try:
-        print(f"📩 メッセージ受信 [{message.channel.name}] from {message.author.name}")
-
-        # 3. Issue作成
-        # タイトル: 接頭辞 + メッセージの冒頭30文字
-        safe_content = content.replace("\n", " ")
-        title_suffix = safe_content[:30] + "..." if len(safe_content) > 30 else safe_content
-        issue_title = f"{config['prefix']}{title_suffix}"
+    print(f"📩 メッセージ受信 [{message.channel.name}] from {message.author.name}")
 
-        # 本文: 投稿者名、元メッセージのURL、メッセージ全文
-        issue_body = (
-            f"**Reporter:** {message.author.display_name} ({message.author})\n"
-            f"**Source:** {message.jump_url}\n\n"
-            f"**Content:**\n{content}"
-        )
+    key = (message.channel.id, message.author.id)
+    job = pending_jobs.get(key)
 
-        # GitHub APIへ送信
-        issue = repo.create_issue(
-            title=issue_title,
-            body=issue_body,
-            labels=config['labels']
-        )
-        print(f"   ✅ Issue Created: #{issue.number} {issue.html_url}")
-
-        # Discordに返信
-        reply_content = (
-            f"{issue.html_url}\n"
-            f"開発用コマンド: `claude issue {issue.number}`"
-        )
-        reply_msg = await message.reply(reply_content)
-
-        # スレッドを作成（議論用）
-        await reply_msg.create_thread(name=f"Discussion: Issue #{issue.number}")
+    # ジョブへの追加とキューへの投入は await より前に済ませる
+    # (返信の送信中にワーカーがジョブを開始しても、本文にこのメッセージが含まれる)
+    if job is not None and not job.started:
+        job.messages.append(message)
+    elif issue_queue.full():
+        await message.reply("⚠️ 現在混み合っています。しばらくしてから再投稿してください。")
+        return
+    else:
+        job = IssueJob(key, config)
+        job.messages.append(message)
+        pending_jobs[key] = job
+        issue_queue.put_nowait(job)
 
+    try:
+        # すぐに受付を返し、Issueができたらリンクに書き換える
+        ack = await message.reply("⏳ Issueを作成中です...")
+        job.acks.append(ack)
+        # 返信の送信中にジョブが終わっていたら、ここで結果を反映する
+        if job.result_content is not None:
+            await deliver_ack(job, ack)
     except Exception as e:
-        error_msg = f"❌ エラーが発生しました: {e}"
-        print(error_msg)
-        await message.channel.send(error_msg)
+        print(f"❌ エラーが発生しました: {e}")
 
 if __name__ == "__main__":
     client.run(DISCORD_TOKEN)
@@ -0,0 +1,319 @@
+"""
+重複フィードバック検出用のローカルIssueインデックス
+
+- GitHubのopen Issueをページ単位のETag付き条件リクエストで同期する
+  (304 Not Modified はレート制限を消費しない)
+- 各Issueを MinHash シグネチャに変換し、LSH(バンド分割)で候補を絞ってから
+  推定Jaccard類似度で判定する。Issueが数千件あっても検索は候補数に比例する
+- 英語はストップワードを除いた単語と単語bigram、日本語は文字n-gramでシングルを作る
+  (短文の誤マージを防ぐため、シングルが少なすぎる文は判定しない)
+- 定型文の使い回し (「〜をCSVで」と「〜をPDFで」など) を取り違えないよう、
+  英単語とカタカナ語を「区別語」として別に比べ、十分一致したときだけ自動マージ候補にする。
+  検索は同じラベル (bug / enhancement) のIssueに限る
+"""
+
+import json
+import os
+import re
+import threading
+import hashlib
+
+import requests
+
+GITHUB_API = "https://api.github.com"
+
+NUM_PERM = 64
+BANDS = 32
+ROWS = NUM_PERM // BANDS
+NGRAM = 2
+DEFAULT_THRESHOLD = 0.5
+# 区別語(英単語・カタカナ語)のJaccard類似度がこれ以上なら自動マージしてよい
+KEY_OVERLAP = 0.8
+# 保存形式を変えたら上げる (古いインデックスは読み捨てて同期し直す)
+INDEX_VERSION = 2
+# これより少ないシングルの文は短すぎて判定できないので重複扱いしない
+MIN_SHINGLES = 6
+
+_MERSENNE = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+# 決定的な係数を使う（インデックスを保存・再読込しても同じシグネチャになる）
+_seed = hashlib.blake2b(b"lore-bridge-minhash", digest_size=64).digest()
+_PERMS = []
+for i in range(NUM_PERM):
+    h = hashlib.blake2b(_seed + i.to_bytes(2, "big"), digest_size=16).digest()
+    _PERMS.append((int.from_bytes(h[:8], "big") % _MERSENNE | 1,
+                   int.from_bytes(h[8:], "big") % _MERSENNE))
+
+_PREFIX_RE = re.compile(r"^\s*\[(idea|bug)\]\s*", re.IGNORECASE)
+_URL_RE = re.compile(r"https?://\S+")
+# Botが付けるメタデータ行は類似度から除外する
+_META_RE = re.compile(r"^\*\*(Reporter|Source):\*\*.*$", re.MULTILINE)
+_WORD_RE = re.compile(r"[a-z0-9_]+")
+_CJK_RE = re.compile(r"[぀-ヿ㐀-鿿ｦ-ﾟ]+")
+_HIRAGANA_RE = re.compile(r"^[぀-ゟ]+$")
+_KATAKANA_RE = re.compile(r"[ァ-ヺー]{2,}|[ｦ-ﾟ]{2,}")
+
+STOPWORDS = {
+    "a", "an", "the", "i", "me", "my", "we", "you", "it", "its", "is", "am", "are",
+    "was", "were", "be", "been", "to", "of", "in", "on", "at", "for", "with", "and",
+    "or", "but", "not", "no", "so", "if", "when", "then", "that", "this", "there",
+    "want", "would", "could", "should", "can", "please", "do", "does", "did", "have",
+    "has", "had", "will", "just", "also", "like", "get", "gets", "from", "by", "as",
+}
+
+
+def _normalize(text):
+    """メタデータ行・URLを除いて小文字にする"""
+    text = _URL_RE.sub(" ", _META_RE.sub(" ", text or "")).lower()
+    return text.replace("**content:**", " ")
+
+
+def shingles(text):
+    """
+    英数字はストップワードを除いた単語と単語bigram、
+    日本語(かな・漢字)は文字n-gramに分解する (ひらがなだけのn-gramは助詞・語尾なので除く)
+    """
+    text = _normalize(text)
+
+    words = [w for w in _WORD_RE.findall(text) if w not in STOPWORDS]
+    result = set(words)
+    result.update(f"{a} {b}" for a, b in zip(words, words[1:]))
+
+    for run in _CJK_RE.findall(text):
+        grams = [run] if len(run) <= NGRAM else [run[i:i + NGRAM] for i in range(len(run) - NGRAM + 1)]
+        result.update(g for g in grams if not _HIRAGANA_RE.match(g))
+    return result
+
+
+def key_terms(text):
+    """
+    文同士を区別する語 (ストップワード以外の英単語とカタカナ語) の集合
+    英単語は複数形の s だけ落として揃える
+    """
+    text = _normalize(text)
+    keys = set(_KATAKANA_RE.findall(text))
+    for word in _WORD_RE.findall(text):
+        if word in STOPWORDS or len(word) < 3:
+            continue
+        if len(word) > 4 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        keys.add(word)
+    return keys
+
+
+def key_overlap(keys_a, keys_b):
+    """区別語のJaccard類似度。どちらにも区別語が無ければ判断できないので0"""
+    keys_a, keys_b = set(keys_a), set(keys_b)
+    if not keys_a and not keys_b:
+        return 0.0
+    return len(keys_a & keys_b) / len(keys_a | keys_b)
+
+
+def minhash(tokens):
+    """シングル集合のMinHashシグネチャ (NUM_PERM個の整数)"""
+    if not tokens:
+        return None
+
+    hashes = [int.from_bytes(hashlib.blake2b(t.encode("utf-8"), digest_size=4).digest(), "big")
+              for t in tokens]
+    return [min(((a * x + b) % _MERSENNE) & _MAX_HASH for x in hashes) for a, b in _PERMS]
+
+
+def similarity(sig_a, sig_b):
+    """2つのシグネチャから推定したJaccard類似度"""
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / NUM_PERM
+
+
+def _band_keys(signature):
+    return [(band, tuple(signature[band * ROWS:(band + 1) * ROWS])) for band in range(BANDS)]
+
+
+class DuplicateIndex:
+    """open IssueのMinHash/LSHインデックス。同期スレッドとイベントループから共有される"""
+
+    def __init__(self, repo_name, token, path="issue_index.json", threshold=DEFAULT_THRESHOLD):
+        self.repo_name = repo_name
+        self.path = path
+        self.threshold = threshold
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Authorization": f"Bearer {token}",
+            "Accept": "application/vnd.github+json",
+        })
+        self.lock = threading.Lock()
+        self.pages = {}       # page番号 -> {"etag": str, "numbers": [int]}
+        self.issues = {}      # issue番号 -> {"title", "url", "labels", "keys", "signature"}
+        self.buckets = {}     # (band, rows) -> set(issue番号)
+        self._load()
+
+    # --- 永続化 ---
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ インデックスを読み込めませんでした: {e}")
+            return
+        if data.get("version") != INDEX_VERSION:
+            print("ℹ️ インデックスの形式が古いため、同期し直します")
+            return
+
+        self.pages = {int(k): v for k, v in data.get("pages", {}).items()}
+        for number, issue in data.get("issues", {}).items():
+            self._add(int(number), issue)
+
+    def save(self):
+        with self.lock:
+            data = {
+                "version": INDEX_VERSION,
+                "pages": {str(k): v for k, v in self.pages.items()},
+                "issues": {str(k): v for k, v in self.issues.items()},
+            }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    # --- インデックス操作 (lockを取得済みで呼ぶ) ---
+
+    def _add(self, number, issue):
+        self._remove(number)
+        self.issues[number] = issue
+        if issue.get("signature"):
+            for key in _band_keys(issue["signature"]):
+                self.buckets.setdefault(key, set()).add(number)
+
+    def _remove(self, number):
+        old = self.issues.pop(number, None)
+        if old and old.get("signature"):
+            for key in _band_keys(old["signature"]):
+                bucket = self.buckets.get(key)
+                if bucket:
+                    bucket.discard(number)
+                    if not bucket:
+                        del self.buckets[key]
+
+    @staticmethod
+    def _entry(title, body, url, labels):
+        """Issue 1件分のインデックスエントリ (ハッシュ計算を含むのでロックの外で作る)"""
+        text = f"{_PREFIX_RE.sub('', title)}\n{body or ''}"
+        return {
+            "title": title,
+            "url": url,
+            "labels": sorted(labels),
+            "keys": sorted(key_terms(text)),
+            "signature": minhash(shingles(text)),
+        }
+
+    def add_issue(self, number, title, body, url, labels=()):
+        """新しく作ったIssueを同期を待たずにインデックスへ追加する"""
+        issue = self._entry(title, body, url, labels)
+        with self.lock:
+            self._add(number, issue)
+
+    # --- GitHubとの同期 ---
+
+    def sync(self):
+        """
+        open Issueをページごとに条件付きリクエストで取得する
+        変化のないページは304が返り、レート制限を消費しない
+
+        Returns:
+            変更があったページ数
+        """
+        changed = 0
+        seen = set()
+        page = 1
+        url = f"{GITHUB_API}/repos/{self.repo_name}/issues"
+
+        while True:
+            cached = self.pages.get(page)
+            headers = {"If-None-Match": cached["etag"]} if cached and cached.get("etag") else {}
+            response = self.session.get(
+                url,
+                params={"state": "open", "per_page": 100, "page": page},
+                headers=headers,
+                timeout=30,
+            )
+
+            if response.status_code == 304:
+                numbers = cached["numbers"]
+            else:
+                response.raise_for_status()
+                items = [i for i in response.json() if "pull_request" not in i]
+                numbers = [i["number"] for i in items]
+                # ハッシュ計算はロックの外で行う (find_duplicate はイベントループから呼ばれるため)
+                entries = [(item["number"], self._entry(
+                    item["title"],
+                    item.get("body"),
+                    item["html_url"],
+                    [label["name"] for label in item.get("labels", [])],
+                )) for item in items]
+                with self.lock:
+                    for number, issue in entries:
+                        self._add(number, issue)
+                    self.pages[page] = {"etag": response.headers.get("ETag"), "numbers": numbers}
+                changed += 1
+
+            seen.update(numbers)
+            has_next = 'rel="next"' in response.headers.get("Link", "")
+            if response.status_code == 304:
+                # 304にはLinkヘッダーが無いことがあるので、次のページのキャッシュ有無で判断する
+                has_next = page + 1 in self.pages
+            if not has_next:
+                break
+            page += 1
+
+        # クローズされたIssueと、もう存在しないページを取り除く
+        with self.lock:
+            for stale in [p for p in self.pages if p > page]:
+                del self.pages[stale]
+            for number in [n for n in self.issues if n not in seen]:
+                self._remove(number)
+
+        if changed:
+            self.save()
+        return changed
+
+    # --- 検索 ---
+
+    def find_duplicate(self, text, label=None):
+        """
+        最も似ているopen Issueを返す
+
+        Args:
+            text: 新しい報告の本文
+            label: 指定すると、このラベルが付いたIssueだけを対象にする
+
+        Returns:
+            (issue番号, issue情報, 類似度, 自動マージしてよいか) または None
+            区別語が十分一致しない場合は「似ているだけ」として False を返す
+        """
+        tokens = shingles(text)
+        if len(tokens) < MIN_SHINGLES:
+            return None
+        signature = minhash(tokens)
+        keys = key_terms(text)
+
+        with self.lock:
+            candidates = set()
+            for key in _band_keys(signature):
+                candidates.update(self.buckets.get(key, ()))
+
+            best = None
+            for number in candidates:
+                issue = self.issues[number]
+                if label is not None and label not in issue.get("labels", ()):
+                    continue
+                score = similarity(signature, issue["signature"])
+                if score >= self.threshold and (best is None or score > best[2]):
+                    best = (number, issue, score)
+
+        if best is None:
+            return None
+        number, issue, score = best
+        return number, issue, score, key_overlap(keys, issue.get("keys", ())) >= KEY_OVERLAP
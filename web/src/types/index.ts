@@ -7,6 +7,8 @@ export interface SearchResult {
   status: 'safe' | 'suspicious' | 'unknown';
   similarity?: number;
   thumbnail?: string;
+  canonical_url?: string;
+  alternates?: string[];
 }
 
 // 作品（IP）の型定義